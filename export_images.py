@@ -1,12 +1,21 @@
 import argparse
-import base64
+import os
 import sqlite3
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
+from functools import lru_cache, partial
 from io import BytesIO
 
 from PIL import Image
 
+try:
+    # pybase64 dùng libbase64 (SIMD: AVX2/NEON), nhanh hơn nhiều so với stdlib
+    from pybase64 import b64decode as _b64decode
+except ImportError:
+    from base64 import b64decode as _b64decode
+
 # -------------------- helpers --------------------
 
 
@@ -32,6 +41,12 @@ def guess_ext_from_ct(ct: str | None) -> str:
     return ".jpg"
 
 
+@lru_cache(maxsize=16)
+def resolve_ext(ext: str | None, ct: str | None) -> str:
+    # chỉ có vài cặp (ext, content_type) khác nhau trong 1 DB → cache lại
+    return ensure_ext(ext or guess_ext_from_ct(ct))
+
+
 def parse_ts(ts_ms, ts_iso) -> datetime:
     if ts_ms is not None:
         try:
@@ -51,56 +66,116 @@ def safe_slug(s: str | None) -> str:
     return s[:80] or "nocode"
 
 
-def pil_save_or_bytes(img_bytes: bytes, out_path: Path):
+def sniff_ext(img_bytes: bytes) -> str | None:
+    """Nhận diện định dạng ảnh qua magic bytes, trả về đuôi file tương ứng."""
+    if img_bytes[:3] == b"\xff\xd8\xff":
+        return ".jpg"
+    if img_bytes[:4] == b"\x89PNG":
+        return ".png"
+    if img_bytes[:4] == b"RIFF" and img_bytes[8:12] == b"WEBP":
+        return ".webp"
+    return None
+
+
+_O_NEW_FILE = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0)
+
+
+def write_bytes(out_path: str | Path, img_bytes: bytes):
+    with open(out_path, "wb") as f:
+        f.write(img_bytes)
+
+
+def write_new_file(out_path: str | Path, img_bytes: bytes):
+    """
+    Ghi bytes ra file mới bằng os.write trực tiếp (không qua buffer của Python).
+    Dùng O_EXCL: file đã tồn tại → FileExistsError thay vì ghi đè.
+    """
+    fd = os.open(out_path, _O_NEW_FILE, 0o644)
+    try:
+        view = memoryview(img_bytes)
+        while view:
+            view = view[os.write(fd, view) :]
+    finally:
+        os.close(fd)
+
+
+def pil_save_or_bytes(img_bytes: bytes, out_path: str | Path):
+    # bytes đã đúng định dạng của đuôi file → ghi thẳng, bỏ qua decode/encode
+    if sniff_ext(img_bytes) == ensure_ext(os.path.splitext(out_path)[1]):
+        write_new_file(out_path, img_bytes)
+        return
     try:
         with Image.open(BytesIO(img_bytes)) as im:
             im.save(out_path)
     except Exception:
-        out_path.write_bytes(img_bytes)
+        write_bytes(out_path, img_bytes)
 
 
-# -------------------- main export --------------------
+def save_image(out_path: str, img_bytes: bytes) -> bool:
+    if not img_bytes:
+        return False
+    try:
+        pil_save_or_bytes(img_bytes, out_path)
+    except FileExistsError:
+        # file xuất hiện sau lần scandir (vd. chạy song song) → bỏ qua
+        return False
+    return True
 
 
-def export_sqlite(
-    db_path: Path, out_root: Path, batch: int = 2000
-) -> tuple[int, int, int]:
-    """
-    Đọc 1 file sqlite_dataset/<CAM_ID>/<YYYY-MM-DD>.sqlite và xuất ảnh ra:
-      images_export/<CAM_ID>/<YYYYMMDD>/<CAM_ID>__<code_slug>__<YYYYMMDD>__<HHMMSS>__<sha8>.<ext>
+def save_b64_image(out_path: str, img_b64: bytes) -> bool:
+    """Chạy trong thread pool: giải base64 rồi ghi ảnh ra file."""
+    try:
+        img_bytes = _b64decode(img_b64, validate=False)
+    except Exception:
+        return False
+    return save_image(out_path, img_bytes)
 
-    - Nếu file ảnh đã tồn tại → bỏ qua (đã xử lý).
-    - Nếu chưa có → giải nén và ghi ra (xử lý tiếp).
-    - Tự nhận diện bảng ('frames' hoặc 'captures') và các cột có sẵn.
-    """
-    if not db_path.exists():
-        raise FileNotFoundError(f"Không tìm thấy file: {db_path}")
 
-    cam_id = db_path.parent.name
-    date_str = db_path.stem  # YYYY-MM-DD
-    date_compact = date_str.replace("-", "")
-    out_dir = out_root / cam_id / date_compact
-    out_dir.mkdir(parents=True, exist_ok=True)
+def save_file_image(base_dir: str, out_path: str, img_path: str) -> bool:
+    """Ảnh lưu ngoài DB (cột img_path, tương đối so với thư mục file .sqlite)."""
+    try:
+        with open(base_dir + img_path, "rb") as f:
+            img_bytes = f.read()
+    except OSError:
+        return False
+    return save_image(out_path, img_bytes)
 
-    conn = sqlite3.connect(str(db_path))
-    conn.row_factory = sqlite3.Row
 
-    # chọn bảng
-    tables = {
-        r["name"]
-        for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")
-    }
-    table = (
-        "frames"
-        if "frames" in tables
-        else ("captures" if "captures" in tables else None)
-    )
-    if not table:
-        raise ValueError(f"Không tìm thấy bảng dữ liệu. Các bảng có: {sorted(tables)}")
+# hàm ghi theo cột img_kind của từng dòng (0: img_bytes, 1: img_b64,
+# 2: img_path — cần thư mục gốc nên được gắn bằng partial trong export_sqlite)
+SAVERS = (save_image, save_b64_image, save_file_image)
 
-    # cột có trong bảng
-    cols = {r[1] for r in conn.execute(f"PRAGMA table_info({table})").fetchall()}
 
+# -------------------- main export --------------------
+
+# vị trí các cột trong câu SELECT của export_sqlite (đọc tuple theo chỉ số)
+(
+    I_CAM,
+    I_SLUG,
+    I_TS_MS,
+    I_TS_ISO,
+    I_SHA,
+    I_EXT,
+    I_CT,
+    I_IMG,
+    I_IMG_KIND,
+    I_DUP,
+) = range(10)
+
+
+SCHEMA_SQL = """
+    SELECT m.name, p.name
+    FROM sqlite_master AS m JOIN pragma_table_info(m.name) AS p
+    WHERE m.type = 'table'
+"""
+
+
+@lru_cache(maxsize=8)
+def build_select_sql(table: str, cols: frozenset[str]) -> str:
+    """
+    Dựng câu SELECT xuất ảnh cho 1 schema (bảng + tập cột).
+    Cache theo schema: xuất nhiều file ngày cùng schema chỉ dựng SQL 1 lần.
+    """
     # map tên cột linh hoạt cho 2 schema
     col_cam = "cam_id" if "cam_id" in cols else None
     col_ts_ms = "ts_vn_ms" if "ts_vn_ms" in cols else None
@@ -116,18 +191,20 @@ def export_sqlite(
     col_ok = "ok" if "ok" in cols else None
     col_ext = "ext" if "ext" in cols else None
     col_ct = "content_type" if "content_type" in cols else None
-    col_w = "w" if "w" in cols else None
-    col_h = "h" if "h" in cols else None
     col_img_bytes = "img_bytes" if "img_bytes" in cols else None
     col_img_b64 = "img_b64" if "img_b64" in cols else None
+    col_img_path = "img_path" if "img_path" in cols else None
+    col_dup = "dup_of_sha" if "dup_of_sha" in cols else None
 
     # kiểm tra tối thiểu
     need_min = [col_cam, col_slug]
     if not all(need_min):
         raise ValueError(f"Thiếu cột cơ bản trong bảng {table}. Có cột: {sorted(cols)}")
 
-    if not (col_img_bytes or col_img_b64):
-        raise ValueError(f"Thiếu cột ảnh (img_bytes/img_b64) trong bảng {table}")
+    if not (col_img_bytes or col_img_b64 or col_img_path):
+        raise ValueError(
+            f"Thiếu cột ảnh (img_bytes/img_b64/img_path) trong bảng {table}"
+        )
 
     if not (col_ts_ms or col_ts_iso):
         raise ValueError(
@@ -138,19 +215,43 @@ def export_sqlite(
     conds = []
     if col_ok:
         conds.append(f"{col_ok}=1")
-    has_b64_cond = (
-        f"{col_img_b64} IS NOT NULL AND {col_img_b64} <> ''" if col_img_b64 else None
-    )
-    has_bytes_cond = f"{col_img_bytes} IS NOT NULL" if col_img_bytes else None
-    if has_b64_cond and has_bytes_cond:
-        conds.append(f"(({has_bytes_cond}) OR ({has_b64_cond}))")
-    elif has_bytes_cond:
-        conds.append(has_bytes_cond)
-    elif has_b64_cond:
-        conds.append(has_b64_cond)
+    # nguồn ảnh có trong schema, theo thứ tự ưu tiên: (cờ img_kind, cột, điều
+    # kiện có ảnh, biểu thức lấy ảnh)
+    sources = []
+    if col_img_path:
+        sources.append(
+            (
+                2,
+                col_img_path,
+                f"{col_img_path} IS NOT NULL AND {col_img_path} <> ''",
+                col_img_path,
+            )
+        )
+    if col_img_bytes:
+        sources.append(
+            (0, col_img_bytes, f"{col_img_bytes} IS NOT NULL", col_img_bytes)
+        )
+    if col_img_b64:
+        # lấy thẳng bytes (BLOB) để bỏ bước decode utf-8 sang str trước base64
+        sources.append(
+            (
+                1,
+                col_img_b64,
+                f"{col_img_b64} IS NOT NULL AND {col_img_b64} <> ''",
+                f"CAST({col_img_b64} AS BLOB)",
+            )
+        )
+    has_img = [src[2] for src in sources]
+    if col_dup:
+        # frame trùng không lưu ảnh, export_sqlite lấy ảnh từ dòng gốc trước nó
+        has_img.append(f"{col_dup} IS NOT NULL AND {col_dup} <> ''")
+    if len(has_img) == 1:
+        conds.append(has_img[0])
+    else:
+        conds.append("(" + " OR ".join(f"({c})" for c in has_img) + ")")
     where_sql = ("WHERE " + " AND ".join(conds)) if conds else ""
 
-    # chọn cột để SELECT
+    # chọn cột để SELECT (thứ tự phải khớp các hằng I_*)
     select_cols = [col_cam, col_slug]
     if col_ts_ms:
         select_cols.append(f"{col_ts_ms} AS ts_ms")
@@ -172,72 +273,132 @@ def export_sqlite(
         select_cols.append(f"{col_ct} AS content_type")
     else:
         select_cols.append("NULL AS content_type")
-    if col_w:
-        select_cols.append(f"{col_w} AS w")
-    else:
-        select_cols.append("NULL AS w")
-    if col_h:
-        select_cols.append(f"{col_h} AS h")
+    # chọn nguồn ảnh 1 lần theo schema, không rẽ nhánh mỗi dòng trong Python;
+    # chỉ khi bảng có nhiều cột ảnh mới để SQL chọn theo từng dòng
+    if len(sources) == 1:
+        kind, _, _, expr = sources[0]
+        select_cols.append(f"{expr} AS img")
+        select_cols.append(f"{kind} AS img_kind")
     else:
-        select_cols.append("NULL AS h")
-    if col_img_bytes:
-        select_cols.append(f"{col_img_bytes} AS img_bytes")
-    else:
-        select_cols.append("NULL AS img_bytes")
-    if col_img_b64:
-        select_cols.append(f"{col_img_b64} AS img_b64")
-    else:
-        select_cols.append("NULL AS img_b64")
+        whens = [f"WHEN COALESCE(length({col}), 0) > 0" for _, col, _, _ in sources]
+        select_cols.append(
+            "CASE "
+            + " ".join(f"{w} THEN {src[3]}" for w, src in zip(whens, sources))
+            + " END AS img"
+        )
+        select_cols.append(
+            "CASE "
+            + " ".join(f"{w} THEN {src[0]}" for w, src in zip(whens, sources))
+            + " ELSE 0 END AS img_kind"
+        )
+    select_cols.append(f"{col_dup} AS dup_of_sha" if col_dup else "NULL AS dup_of_sha")
 
-    order_sql = "ORDER BY " + (
-        col_ts_ms if col_ts_ms else (col_ts_iso if col_ts_iso else col_cam)
+    # 1 truy vấn duy nhất, đọc lần lượt từng dòng từ cursor: bộ nhớ chỉ giữ
+    # các ảnh đang chờ ghi thay vì cả batch BLOB như fetchall()
+    order_col = col_ts_ms or col_ts_iso
+    return (
+        f"SELECT {', '.join(select_cols)} FROM {table} {where_sql} ORDER BY {order_col}"
     )
-    base_sql = f"SELECT {', '.join(select_cols)} FROM {table} {where_sql} {order_sql} LIMIT ? OFFSET ?"
+
+
+def export_sqlite(
+    db_path: Path, out_root: Path, batch: int = 64
+) -> tuple[int, int, int]:
+    """
+    Đọc 1 file sqlite_dataset/<CAM_ID>/<YYYY-MM-DD>.sqlite và xuất ảnh ra:
+      images_export/<CAM_ID>/<YYYYMMDD>/<CAM_ID>__<code_slug>__<YYYYMMDD>__<HHMMSS>__<sha8>.<ext>
+
+    - Nếu file ảnh đã tồn tại → bỏ qua (đã xử lý).
+    - Nếu chưa có → giải nén và ghi ra (xử lý tiếp).
+    - Tự nhận diện bảng ('frames' hoặc 'captures') và các cột có sẵn.
+    - Frame trùng (dup_of_sha) được xuất bằng ảnh của dòng gốc ngay trước nó.
+    """
+    if not db_path.exists():
+        raise FileNotFoundError(f"Không tìm thấy file: {db_path}")
+
+    cam_id = db_path.parent.name
+    date_str = db_path.stem  # YYYY-MM-DD
+    date_compact = date_str.replace("-", "")
+    out_dir = out_root / cam_id / date_compact
+    out_dir.mkdir(parents=True, exist_ok=True)
+    # 1 lần scandir thay cho 1 lần stat() mỗi dòng khi kiểm tra file đã xuất
+    existing = {entry.name for entry in os.scandir(out_dir)}
+
+    # chỉ đọc: mở read-only và chỉnh pragma cho quét BLOB tuần tự
+    conn = sqlite3.connect(f"{db_path.resolve().as_uri()}?mode=ro", uri=True)
+    conn.execute("PRAGMA query_only=ON;")
+    conn.execute("PRAGMA mmap_size=1073741824;")
+    conn.execute("PRAGMA cache_size=-65536;")
+    conn.execute("PRAGMA temp_store=MEMORY;")
+
+    # đọc schema (bảng + cột) bằng 1 truy vấn
+    schema: dict[str, set[str]] = {}
+    for tbl, col in conn.execute(SCHEMA_SQL):
+        schema.setdefault(tbl, set()).add(col)
+    table = (
+        "frames"
+        if "frames" in schema
+        else ("captures" if "captures" in schema else None)
+    )
+    if not table:
+        raise ValueError(f"Không tìm thấy bảng dữ liệu. Các bảng có: {sorted(schema)}")
+    base_sql = build_select_sql(table, frozenset(schema[table]))
 
     exported = 0
-    skipped = 0
     total_ok = 0
-    offset = 0
+    # phần cố định của tên file / đường dẫn, tính 1 lần ngoài vòng lặp
+    name_prefix = f"{cam_id}__"
+    name_mid = f"__{date_compact}__"
+    out_dir_str = os.path.join(out_dir, "")
+
+    # img_path tương đối so với thư mục chứa file .sqlite
+    savers = SAVERS[:2] + (
+        partial(save_file_image, os.path.join(db_path.resolve().parent, "")),
+    )
 
-    while True:
-        rows = conn.execute(base_sql, (batch, offset)).fetchall()
-        if not rows:
-            break
-        for row in rows:
+    # Pillow nhả GIL khi encode/decode và ghi file là I/O chặn → dùng thread
+    workers = min(32, (os.cpu_count() or 1) * 2)
+    pending: deque[Future] = deque()
+    # ảnh gốc gần nhất (sha, img_kind, img): runner chỉ đánh dấu trùng so với
+    # ảnh vừa lưu trước đó trong cùng file ngày nên chỉ cần nhớ 1 ảnh
+    last_img: tuple | None = None
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for row in conn.execute(base_sql):
             total_ok += 1
 
-            ts = parse_ts(row["ts_ms"], row["ts_iso"])
-            slug = safe_slug(row[col_slug])
-            sha_hex = (row["sha256"] or "").strip()
+            ts = parse_ts(row[I_TS_MS], row[I_TS_ISO])
+            slug = safe_slug(row[I_SLUG])
+            sha_hex = (row[I_SHA] or "").strip()
             sha8 = sha_hex[:8] if sha_hex else "nohash"
 
-            ext = ensure_ext(row["ext"] or guess_ext_from_ct(row["content_type"]))
-            hhmmss = ts.strftime("%H%M%S")
-            filename = f"{cam_id}__{slug}__{date_compact}__{hhmmss}__{sha8}{ext}"
-            out_path = out_dir / filename
+            img = row[I_IMG]
+            kind = row[I_IMG_KIND]
+            if img:
+                last_img = (sha_hex, kind, img)
+            elif last_img and row[I_DUP] and row[I_DUP] == last_img[0]:
+                _, kind, img = last_img
 
-            if out_path.exists():
-                skipped += 1
+            ext = resolve_ext(row[I_EXT], row[I_CT])
+            hhmmss = ts.strftime("%H%M%S")
+            filename = f"{name_prefix}{slug}{name_mid}{hhmmss}__{sha8}{ext}"
+            if filename in existing:
                 continue
 
-            img_bytes = row["img_bytes"]
-            if not img_bytes and row["img_b64"]:
-                try:
-                    img_bytes = base64.b64decode(row["img_b64"])
-                except Exception:
-                    img_bytes = b""
-
-            if not img_bytes:
-                skipped += 1
+            if not img:
                 continue
 
-            pil_save_or_bytes(img_bytes, out_path)
-            exported += 1
+            existing.add(filename)
+            pending.append(pool.submit(savers[kind], out_dir_str + filename, img))
+            # giới hạn số ảnh đang chờ ghi (backpressure), nổi lỗi ghi sớm
+            if len(pending) >= batch:
+                exported += pending.popleft().result()
 
-        offset += batch
+        while pending:
+            exported += pending.popleft().result()
 
     conn.close()
-    return exported, skipped, total_ok
+    # dòng nào không được ghi ra (đã có file / không có ảnh) đều tính là bỏ qua
+    return exported, total_ok - exported, total_ok
 
 
 # -------------------- CLI --------------------
@@ -253,7 +414,9 @@ def main():
         help="Đường dẫn sqlite_dataset/<CAM_ID>/<YYYY-MM-DD>.sqlite",
     )
     ap.add_argument("--out-root", default="images_export", help="Thư mục gốc xuất ảnh")
-    ap.add_argument("--batch", type=int, default=2000, help="Batch size đọc DB")
+    ap.add_argument(
+        "--batch", type=int, default=64, help="Số ảnh tối đa đang chờ ghi cùng lúc"
+    )
     args = ap.parse_args()
 
     exported, skipped, total_ok = export_sqlite(
@@ -1,31 +1,81 @@
 import argparse
 import asyncio
-import base64
 import hashlib
 import json
 import os
+import queue
+import re
 import sqlite3
+import struct
 import sys
 import threading
+import time
 import unicodedata
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache, partial
 from io import BytesIO
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 from urllib.parse import urlparse
 
+import httpx
 from PIL import Image
-from playwright.async_api import Page, async_playwright
+from playwright.async_api import Page, Response, async_playwright
 
 # -------- Cấu hình --------
-INTERVAL_SEC = 15.0
-PAGE_TIMEOUT_S = 20
-HEADFUL = False
-DB_ROOT = Path("sqlite_dataset")
-STORE_BASE64 = False
-DEBUG = True  
+JPEG_QUALITY = 85  # chất lượng JPEG khi đổi GIF → JPEG
+IMG_CACHE_PER_CAM = 4  # số ảnh browser đã tải giữ lại cho mỗi camera
+PAGE_MAX_FAILS = 3  # số tick liên tiếp page không ra ảnh thì mở lại page
+COMMIT_EVERY = 4  # số dòng chờ tối đa trước khi commit (mỗi file cam/ngày)
+FLUSH_SEC = 60.0  # commit các dòng còn chờ ít nhất mỗi FLUSH_SEC giây
+WRITER_BATCH = 16  # số dòng tối đa writer thread gom vào 1 lần ghi
+COOKIE_SYNC_SEC = 300.0  # chép lại cookie browser sang httpx mỗi ngần này giây
+# tắt các thành phần Chromium không dùng tới khi chỉ đọc ảnh camera
+CHROMIUM_ARGS = [
+    "--disable-gpu",
+    "--disable-dev-shm-usage",
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--disable-features=Translate,BackForwardCache,InterestFeedContentSuggestions",
+    "--disable-renderer-backgrounding",
+    "--disable-backgrounding-occluded-windows",
+    "--mute-audio",
+]
 # -----------------------------------
 
+try:
+    # orjson parse thẳng từ bytes, nhanh hơn json của stdlib
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    # có gói h2 thì 6 request ảnh dùng chung 1 kết nối HTTP/2
+    import h2  # noqa: F401
+
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
+
+try:
+    # xxh3 nhanh hơn nhiều so với sha256, đủ dùng cho tag/nhãn ngắn
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    # PyTurboJPEG gọi thẳng libjpeg-turbo, encode nhanh hơn Pillow
+    import numpy as np
+    from turbojpeg import TJPF_RGB, TJSAMP_420, TurboJPEG
+
+    _TURBO = TurboJPEG()
+except Exception:  # thiếu package hoặc không tìm thấy libturbojpeg
+    _TURBO = None
+
 try:
     from zoneinfo import ZoneInfo
 
@@ -38,17 +88,49 @@ def now_vn() -> datetime:
     return datetime.now(VN_TZ)
 
 
+@dataclass(slots=True)
+class CaptureConfig:
+    """Cấu hình 1 lần chạy; mặc định khớp với các hằng số trước đây."""
+
+    interval: float = 15.0  # khoảng cách giữa các lần chụp (giây)
+    offset: float = 0.0  # delay trước tick đầu tiên (giây)
+    page_timeout: float = 20  # timeout tải page / GET ảnh (giây)
+    headful: bool = False  # hiển thị browser GUI
+    debug: bool = True  # in trạng thái từng camera mỗi tick
+    db_root: Path = field(default_factory=lambda: Path("sqlite_dataset"))
+    max_pages: int = 0  # số page dùng chung; 0 = mỗi camera 1 page riêng
+
+
+class _SlugTable(dict):
+    """Bảng cho str.translate: bỏ dấu (combining), ký tự lạ → "_".
+
+    Ký tự được tính lần đầu gặp rồi cache, các lần sau translate chạy hoàn
+    toàn trong C.
+    """
+
+    def __missing__(self, code: int):
+        ch = chr(code)
+        if unicodedata.combining(ch):
+            out = None
+        elif ch.isalnum() or ch in "._-":
+            out = ch
+        else:
+            out = "_"
+        self[code] = out
+        return out
+
+
+_SLUG_TABLE = _SlugTable()
+_UNDERSCORES_RE = re.compile(r"_{2,}")
+
+
+@lru_cache(maxsize=512)
 def slugify(text: Optional[str]) -> str:
     if not text:
         return "nocode"
     text = unicodedata.normalize("NFKD", text)
-    text = "".join(c for c in text if not unicodedata.combining(c))
-    text = text.strip().lower()
-    s = "".join((ch if (ch.isalnum() or ch in "._- ") else "_") for ch in text).replace(
-        " ", "_"
-    )
-    while "__" in s:
-        s = s.replace("__", "_")
+    s = text.translate(_SLUG_TABLE).lower()
+    s = _UNDERSCORES_RE.sub("_", s)
     return s.strip("._-") or "nocode"
 
 
@@ -56,117 +138,519 @@ def sha256_bytes(b: bytes) -> str:
     return hashlib.sha256(b).hexdigest()
 
 
+def name_tag(b: bytes) -> str:
+    """Tag 8 ký tự hex, không dùng cho mục đích bảo mật."""
+    if xxhash is not None:
+        return xxhash.xxh3_64_hexdigest(b)[:8]
+    return sha256_bytes(b[:65536])[:8]
+
+
 def short_lab(lab: str) -> str:
-    return lab if len(lab) <= 12 else (lab[:10] + "_" + sha256_bytes(lab.encode())[:4])
+    return lab if len(lab) <= 12 else (lab[:10] + "_" + name_tag(lab.encode())[:4])
+
+
+def _jpeg_size(b: bytes) -> Optional[Tuple[int, int]]:
+    # duyệt các marker tới SOFn (bỏ DHT/JPG/DAC dùng chung dải C4/C8/CC)
+    i, n = 2, len(b)
+    while i + 9 <= n:
+        if b[i] != 0xFF:
+            return None
+        marker = b[i + 1]
+        if marker == 0xFF:  # byte đệm
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:  # marker không có độ dài
+            i += 2
+            continue
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            h, w = struct.unpack_from(">HH", b, i + 5)
+            return w, h
+        i += 2 + struct.unpack_from(">H", b, i + 2)[0]
+    return None
+
+
+def _webp_size(b: bytes) -> Optional[Tuple[int, int]]:
+    chunk = b[12:16]
+    if chunk == b"VP8 " and b[23:26] == b"\x9d\x01\x2a":
+        w, h = struct.unpack_from("<HH", b, 26)
+        return w & 0x3FFF, h & 0x3FFF
+    # int.from_bytes của lát cắt thiếu byte vẫn ra số → tự kiểm tra độ dài
+    if chunk == b"VP8L" and b[20:21] == b"\x2f":
+        if len(b) < 25:
+            return None
+        bits = int.from_bytes(b[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X":
+        if len(b) < 30:
+            return None
+        return (
+            int.from_bytes(b[24:27], "little") + 1,
+            int.from_bytes(b[27:30], "little") + 1,
+        )
+    return None
+
+
+def image_size(b: bytes) -> Optional[Tuple[int, int]]:
+    """
+    (w, h) đọc thẳng từ header JPEG/PNG/WebP, không qua Pillow.
+    Không nhận ra định dạng / header hỏng → None.
+    """
+    try:
+        if b.startswith(b"\xff\xd8"):
+            return _jpeg_size(b)
+        if b.startswith(b"\x89PNG\r\n\x1a\n") and b[12:16] == b"IHDR":
+            return struct.unpack_from(">II", b, 16)
+        if b.startswith(b"RIFF") and b[8:12] == b"WEBP":
+            return _webp_size(b)
+    except struct.error:
+        pass
+    return None
+
+
+@lru_cache(maxsize=64)
+def ext_from_content_type(content_type: str) -> str:
+    # mỗi cam trả về vài content-type cố định → cache, khỏi lower()/dò mỗi tick
+    ct = content_type.lower()
+    if "png" in ct:
+        return ".png"
+    if "webp" in ct:
+        return ".webp"
+    return ".jpg"
+
+
+def ext_from_url(url: str) -> str:
+    p = urlparse(url).path.lower()
+    for e in (".jpg", ".jpeg", ".png", ".webp"):
+        if p.endswith(e):
+            return ".jpg" if e == ".jpeg" else e
+    return ".jpg"
 
 
 def force_jpeg_if_gif(
     img_bytes: bytes, content_type: Optional[str], url_hint: Optional[str]
 ) -> Tuple[bytes, str, bool, Optional[int], Optional[int]]:
-    is_gif = False
-    if content_type and "gif" in content_type.lower():
-        is_gif = True
-    elif img_bytes[:4] in (b"GIF8",):
-        is_gif = True
-    elif url_hint and urlparse(url_hint).path.lower().endswith(".gif"):
-        is_gif = True
-    if not is_gif:
-        w = h = None
-        try:
-            im = Image.open(BytesIO(img_bytes))
-            w, h = im.size
-        except Exception:
-            pass
-        ext = ".jpg"
+    # magic bytes là căn cứ duy nhất: content-type/URL có thể ghi sai
+    if not img_bytes.startswith(b"GIF8"):
+        # đọc kích thước từ header; chỉ định dạng lạ mới nhờ Pillow
+        size = image_size(img_bytes)
+        if size is None:
+            try:
+                size = Image.open(BytesIO(img_bytes)).size
+            except Exception:
+                size = (None, None)
+        w, h = size
         if content_type:
-            ct = content_type.lower()
-            if "png" in ct:
-                ext = ".png"
-            elif "webp" in ct:
-                ext = ".webp"
+            ext = ext_from_content_type(content_type)
         elif url_hint:
-            p = urlparse(url_hint).path.lower()
-            for e in (".jpg", ".jpeg", ".png", ".webp"):
-                if p.endswith(e):
-                    ext = ".jpg" if e == ".jpeg" else e
+            ext = ext_from_url(url_hint)
+        else:
+            ext = ".jpg"
         return img_bytes, ext, False, w, h
-    im = Image.open(BytesIO(img_bytes))
-    try:
-        im.seek(0)
-    except Exception:
-        pass
+    # mới mở thì đang ở frame 0; chỉ định GIF để khỏi dò thử các định dạng khác
+    im = Image.open(BytesIO(img_bytes), formats=["GIF"])
     if im.mode in ("RGBA", "LA", "P"):
+        # ghép lên nền trắng; paste dùng thẳng kênh alpha của ảnh RGBA làm
+        # mask nên không cần split() ra 4 ảnh kênh riêng
+        im = im.convert("RGBA")
         bg = Image.new("RGB", im.size, (255, 255, 255))
-        if im.mode == "P":
-            im = im.convert("RGBA")
-        bg.paste(im, mask=im.split()[-1] if im.mode == "RGBA" else None)
+        bg.paste(im, mask=im)
         im = bg
     else:
         im = im.convert("RGB")
-    out = BytesIO()
-    im.save(out, format="JPEG", quality=90, optimize=True)
-    b2 = out.getvalue()
     w, h = im.size
-    return b2, ".jpg", True, w, h
+    return encode_jpeg(im), ".jpg", True, w, h
+
+
+def encode_jpeg(im: Image.Image) -> bytes:
+    """Encode ảnh RGB sang JPEG, ưu tiên libjpeg-turbo (PyTurboJPEG) nếu có."""
+    if _TURBO is not None:
+        return _TURBO.encode(
+            np.asarray(im),
+            quality=JPEG_QUALITY,
+            pixel_format=TJPF_RGB,
+            jpeg_subsample=TJSAMP_420,
+        )
+    out = BytesIO()
+    # optimize=True chạy thêm 1 lượt Huffman chỉ để giảm ~1-2% dung lượng
+    im.save(
+        out,
+        format="JPEG",
+        quality=JPEG_QUALITY,
+        subsampling="4:2:0",
+        optimize=False,
+        progressive=False,
+    )
+    return out.getvalue()
+
+
+# JS chọn ảnh lớn nhất đang hiển thị; cài 1 lần cho cả context qua
+# add_init_script, mỗi tick chỉ gửi lời gọi window.__pickImg()
+PICK_IMG_INIT_JS = """
+window.__pickImg = () => {
+  // ảnh đã chọn ở tick trước vẫn còn trên trang và đủ lớn thì dùng lại luôn
+  const last = window.__pickedImg;
+  if (last && last.isConnected && (last.naturalWidth||0)>=80 && (last.naturalHeight||0)>=80)
+    return last.currentSrc || last.src || null;
+  // 1 lượt tìm ảnh >= 80x80 có diện tích lớn nhất, không tạo mảng / sort
+  const imgs = document.images;
+  if (!imgs || !imgs.length) return null;
+  let big = null, bestA = -1;
+  for (const i of imgs) {
+    const w = i.naturalWidth||0, h = i.naturalHeight||0;
+    if (w>=80 && h>=80 && w*h>bestA) { bestA = w*h; big = i; }
+  }
+  window.__pickedImg = big;
+  const pick = big || imgs[0];
+  return pick.currentSrc || pick.src || null;
+};
+"""
+
+
+# page đã có ảnh camera (>= 80x80) tải xong → dùng cho wait_for_function
+IMG_READY_JS = (
+    "() => Array.from(document.images)"
+    ".some(i => i.naturalWidth >= 80 && i.naturalHeight >= 80)"
+)
+IMG_READY_START_MS = 3000  # chờ tối đa khi mới mở page lúc khởi động
+IMG_READY_RETRY_MS = 1000  # chờ tối đa khi tick chưa thấy ảnh
 
 
 async def get_displayed_img_url(page: Page) -> Optional[str]:
     try:
-        return await page.evaluate(
-            """() => {
-              const imgs = Array.from(document.images || []);
-              if (!imgs.length) return null;
-              const big = imgs.filter(i => (i.naturalWidth||0)>=80 && (i.naturalHeight||0)>=80)
-                              .sort((a,b)=>(b.naturalWidth*b.naturalHeight)-(a.naturalWidth*a.naturalHeight))[0];
-              const pick = big || imgs[0];
-              return pick.currentSrc || pick.src || null;
-            }"""
-        )
+        return await page.evaluate("window.__pickImg()")
     except Exception:
         return None
 
 
+IMG_HEADERS = {
+    "User-Agent": "Mozilla/5.0",
+    "Origin": "https://giaothong.hochiminhcity.gov.vn",
+    "Accept": "image/avif,image/webp,image/*,*/*;q=0.8",
+}
+
+
+async def new_http_client(context, timeout: float) -> httpx.AsyncClient:
+    """
+    Client HTTP dùng chung cho mọi lần GET ảnh, giữ kết nối keep-alive (và
+    HTTP/2 nếu có h2) thay vì đi vòng qua Playwright. Cookie chép từ browser
+    context, sau đó đồng bộ lại bằng sync_cookies.
+    """
+    client = httpx.AsyncClient(
+        http2=_HTTP2,
+        headers=IMG_HEADERS,
+        timeout=httpx.Timeout(timeout),
+        follow_redirects=True,
+    )
+    await sync_cookies(client, context)
+    return client
+
+
+async def sync_cookies(http: httpx.AsyncClient, context):
+    """
+    Thay cookie của client bằng cookie hiện tại của browser context: site có
+    thể xoay/gia hạn session, cookie chép lúc khởi động sẽ hết hạn dần.
+    """
+    try:
+        cookies = await context.cookies()
+    except Exception:
+        return
+    http.cookies.clear()
+    for c in cookies:
+        http.cookies.set(c["name"], c["value"], domain=c["domain"], path=c["path"])
+
+
 async def fetch_img_bytes(
-    page: Page, img_url: str, referer: str
+    http: httpx.AsyncClient, img_url: str, referer: str
 ) -> Tuple[Optional[bytes], Optional[str]]:
     try:
-        resp = await page.context.request.get(
-            img_url,
-            headers={
-                "User-Agent": "Mozilla/5.0",
-                "Referer": referer,
-                "Origin": "https://giaothong.hochiminhcity.gov.vn",
-                "Accept": "image/avif,image/webp,image/*,*/*;q=0.8",
-            },
-            timeout=PAGE_TIMEOUT_S * 1000,
-        )
-        if resp.ok:
-            return await resp.body(), resp.headers.get("content-type")
+        resp = await http.get(img_url, headers={"Referer": referer})
+        if resp.is_success:
+            return resp.content, resp.headers.get("content-type")
     except Exception:
         pass
     return None, None
 
 
-async def init_six_pages(
-    context, cams: List[Dict[str, Any]]
-) -> List[Tuple[Dict[str, Any], Page]]:
-    pages: List[Page] = [await context.new_page() for _ in range(len(cams))]
-    await asyncio.gather(
-        *[
-            p.goto(c["expand_url"], wait_until="domcontentloaded")
-            for p, c in zip(pages, cams)
-        ]
-    )
-    await asyncio.sleep(2.0)
-    return list(zip(cams, pages))
+# tài nguyên không cần để đọc ảnh camera: chặn để page tải nhẹ hơn
+BLOCKED_RESOURCE_TYPES = frozenset({"stylesheet", "font", "media"})
+BLOCKED_URL_PARTS = ("google-analytics", "googletagmanager", "/analytics")
+
+
+async def block_unneeded(route):
+    req = route.request
+    if req.resource_type in BLOCKED_RESOURCE_TYPES or any(
+        part in req.url for part in BLOCKED_URL_PARTS
+    ):
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+class PagePool:
+    """
+    Mặc định giữ 1 page đã mở sẵn cho mỗi camera trong cùng 1 browser context.
+    Page bị đóng/crash, gây lỗi khi chụp hoặc PAGE_MAX_FAILS tick liên tiếp
+    không ra ảnh sẽ được mở lại (ở lần acquire kế tiếp) riêng cho camera đó,
+    không làm dừng cả runner.
+
+    Với 0 < max_pages < số camera: chỉ giữ tối đa max_pages page dùng chung.
+    Mỗi lần acquire sẽ mượn 1 page rảnh, mở trang của camera, chờ có ảnh;
+    trả về thì chuyển page sang about:blank để trang camera không chạy nền.
+    Tốn thêm thời gian điều hướng mỗi tick nhưng đỡ RAM/CPU của Chromium.
+    """
+
+    def __init__(
+        self,
+        context,
+        cams: List[Dict[str, Any]],
+        max_pages: int = 0,
+        page_timeout: float = 20,
+    ):
+        self.context = context
+        self.cams: Dict[str, Dict[str, Any]] = {
+            (c.get("cam_id") or "unknown"): c for c in cams
+        }
+        self.pages: Dict[str, Page] = {}
+        # page → cam_id đang dùng page đó (để gắn ảnh tải về đúng camera)
+        self.page_cam: Dict[Page, str] = {}
+        # response ảnh mà chính page đã tải về: cam_id -> {url: Response}; chỉ
+        # gọi body() khi thật sự dùng tới, không chép mọi frame sang Python
+        self.images: Dict[str, Dict[str, Response]] = {}
+        self.max_pages = max_pages if 0 < max_pages < len(self.cams) else 0
+        self.idle: List[Page] = []
+        self.sem = asyncio.Semaphore(self.max_pages) if self.max_pages else None
+        self.timeout_ms = page_timeout * 1000
+        # page có renderer đã crash: is_closed() vẫn False nên phải tự đánh dấu
+        self.crashed: Set[Page] = set()
+        # số tick liên tiếp không lấy được ảnh từ page, theo cam_id
+        self.fails: Dict[str, int] = {}
+
+    async def _new_page(self) -> Page:
+        page = await self.context.new_page()
+        page.on("response", partial(self._on_response, page))
+        page.on("crash", self.crashed.add)
+        return page
+
+    def _usable(self, page: Optional[Page]) -> bool:
+        return not (page is None or page.is_closed() or page in self.crashed)
+
+    def report(self, cam_id: str, ok: bool):
+        """Ghi nhận kết quả đọc ảnh từ page của cam_id (đếm lỗi liên tiếp)."""
+        if ok:
+            self.fails.pop(cam_id, None)
+        else:
+            self.fails[cam_id] = self.fails.get(cam_id, 0) + 1
+
+    def mark_stale(self, cam_id: str):
+        """Buộc mở lại page của cam_id ở lần acquire kế tiếp."""
+        self.fails[cam_id] = PAGE_MAX_FAILS
+
+    def _on_response(self, page: Page, response: Response):
+        cam_id = self.page_cam.get(page)
+        if cam_id is None:
+            return
+        if response.request.resource_type != "image" or not response.ok:
+            return
+        cache = self.images.setdefault(cam_id, {})
+        cache[response.url] = response
+        while len(cache) > IMG_CACHE_PER_CAM:
+            del cache[next(iter(cache))]
+
+    async def take_image(
+        self, cam_id: str, img_url: str
+    ) -> Tuple[Optional[bytes], Optional[str]]:
+        """
+        Lấy (1 lần) bytes ảnh mà browser đã tải cho img_url, nếu có.
+        Body không còn (page đã điều hướng/đóng) → (None, None) để GET lại.
+        """
+        response = self.images.get(cam_id, {}).pop(img_url, None)
+        if response is None:
+            return None, None
+        try:
+            return await response.body(), response.headers.get("content-type")
+        except Exception:
+            return None, None
+
+    async def open_all(self):
+        await self.context.add_init_script(PICK_IMG_INIT_JS)
+        await self.context.route("**/*", block_unneeded)
+        if self.max_pages:
+            return  # page dùng chung được tạo khi cần trong acquire
+        for cam_id in self.cams:
+            page = await self._new_page()
+            self.pages[cam_id] = page
+            self.page_cam[page] = cam_id
+        await asyncio.gather(
+            *[
+                self.pages[cam_id].goto(c["expand_url"], wait_until="domcontentloaded")
+                for cam_id, c in self.cams.items()
+            ]
+        )
+        # chờ tới khi mỗi page có ảnh thay vì sleep cố định
+        await asyncio.gather(
+            *[self.wait_for_img(p, IMG_READY_START_MS) for p in self.pages.values()]
+        )
+
+    async def _close(self, page: Page):
+        self.page_cam.pop(page, None)
+        self.crashed.discard(page)
+        try:
+            await page.close()
+        except Exception:
+            pass
+
+    async def reopen(self, cam_id: str) -> Page:
+        self.fails.pop(cam_id, None)
+        old = self.pages.pop(cam_id, None)
+        if old is not None:
+            await self._close(old)
+        page = await self._new_page()
+        self.pages[cam_id] = page
+        self.page_cam[page] = cam_id
+        await page.goto(self.cams[cam_id]["expand_url"], wait_until="domcontentloaded")
+        await self.wait_for_img(page, IMG_READY_START_MS)
+        return page
+
+    async def wait_for_img(self, page: Page, timeout_ms: Optional[float] = None):
+        """Chờ page hiện ảnh camera, tối đa timeout_ms (mặc định page_timeout)."""
+        try:
+            await page.wait_for_function(
+                IMG_READY_JS,
+                timeout=self.timeout_ms if timeout_ms is None else timeout_ms,
+            )
+        except Exception:
+            pass  # để bước lấy URL ảnh tự xử lý (no_img_found)
+
+    @asynccontextmanager
+    async def _acquire_shared(self, cam_id: str):
+        async with self.sem:
+            page = self.idle.pop() if self.idle else None
+            if not self._usable(page):
+                if page is not None:
+                    await self._close(page)
+                page = await self._new_page()
+            self.page_cam[page] = cam_id
+            try:
+                await page.goto(
+                    self.cams[cam_id]["expand_url"], wait_until="domcontentloaded"
+                )
+                await self.wait_for_img(page)
+                yield page
+            except BaseException:
+                await self._close(page)
+                raise
+            self.page_cam.pop(page, None)
+            try:
+                await page.goto("about:blank")
+                self.idle.append(page)
+            except Exception:
+                await self._close(page)
+
+    @asynccontextmanager
+    async def acquire(self, cam_id: str):
+        try:
+            if self.max_pages:
+                async with self._acquire_shared(cam_id) as page:
+                    yield page
+                return
+            page = self.pages.get(cam_id)
+            if not self._usable(page) or self.fails.get(cam_id, 0) >= PAGE_MAX_FAILS:
+                page = await self.reopen(cam_id)
+            try:
+                yield page
+            except Exception:
+                try:
+                    await self.reopen(cam_id)
+                except Exception:
+                    pass
+                raise
+        except asyncio.CancelledError:
+            # bị huỷ (quá hạn chụp) khi đang dùng page → page có thể đang treo;
+            # không await reopen lúc bị huỷ, đánh dấu để lần acquire sau mở lại
+            self.mark_stale(cam_id)
+            raise
+
+
+# thứ tự cột của tuple tham số (DayDb._params), cột ảnh nằm cuối
+UPSERT_COLS = (
+    "cam_id",
+    "ts_vn_ms",
+    "ts_vn_iso",
+    "chunk_file",
+    "code_slug",
+    "expand_url",
+    "img_url",
+    "content_type",
+    "ext",
+    "w",
+    "h",
+    "sha256",
+    "was_gif",
+    "ok",
+    "err",
+    "dup_of_sha",
+)
+
+
+def _upsert_sql(img_col: str) -> str:
+    cols = (*UPSERT_COLS, img_col)
+    updates = ",\n        ".join(f"{c}=excluded.{c}" for c in cols[2:])
+    return f"""
+    INSERT INTO frames ({", ".join(cols)})
+    VALUES ({", ".join("?" * len(cols))})
+    ON CONFLICT(cam_id, ts_vn_ms) DO UPDATE SET
+        {updates}
+"""
+
+
+# SQL dựng 1 lần, tham số theo vị trí (?) → executemany chỉ nhận tuple
+UPSERT_SQL = _upsert_sql("img_path")
+
+# cột thêm sau bản schema đầu tiên: file ngày cũ được ALTER TABLE khi mở
+ADDED_COLS = {"dup_of_sha": "TEXT", "img_path": "TEXT"}
+
+
+def write_file_atomic(path: Path, data: bytes):
+    """Ghi ra file tạm cạnh đích rồi os.replace: không ai đọc phải file ghi dở."""
+    tmp = path.with_name(path.name + ".tmp")
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view) :]
+    finally:
+        os.close(fd)
+    os.replace(tmp, path)
 
 
 class DayDb:
-    def __init__(self, db_root: Path, cam_id: str, chunk_file: str):
+    """
+    Ghi frame vào file db_root/<cam_id>/<YYYY-MM-DD>.sqlite. Ảnh nằm ngoài DB,
+    ở db_root/<cam_id>/<YYYY-MM-DD>/<ts_ms><ext>; cột img_path lưu đường dẫn
+    tương đối so với thư mục chứa file .sqlite.
+    Không commit từng dòng: gom tới commit_every dòng (hoặc tới khi flush()/
+    close()/sang ngày mới) rồi commit 1 lần để giảm số lần fsync WAL.
+    """
+
+    def __init__(
+        self,
+        db_root: Path,
+        cam_id: str,
+        chunk_file: str,
+        commit_every: int = COMMIT_EVERY,
+    ):
         self.db_root = db_root
         self.cam_id = cam_id
         self.chunk_file = chunk_file
+        self.commit_every = commit_every
+        self._dirty = 0  # số dòng đã INSERT nhưng chưa commit
+        # sha256 của ảnh cuối cùng đã lưu file: frame trùng chỉ ghi metadata
+        self.last_sha: Optional[str] = None
         self.conn: Optional[sqlite3.Connection] = None
+        # connection chỉ đọc, tách khỏi connection ghi (xem get_reader)
+        self.rconn: Optional[sqlite3.Connection] = None
+        self._rconn_date: Optional[str] = None
+        self._rlock = threading.Lock()
         self.current_date_str: Optional[str] = None
         (self.db_root / self.cam_id).mkdir(parents=True, exist_ok=True)
 
@@ -175,6 +659,7 @@ class DayDb:
 
     def _open_conn_for_date(self, date_str: str):
         if self.conn:
+            self.flush()
             self.conn.close()
         db_path = self._db_path_for_date(date_str)
         self.conn = sqlite3.connect(db_path)
@@ -200,10 +685,15 @@ class DayDb:
                 ok           INTEGER,
                 err          TEXT,
                 img_bytes    BLOB,
-                img_b64      TEXT
+                dup_of_sha   TEXT,
+                img_path     TEXT
             );
             """
         )
+        cols = {r[1] for r in self.conn.execute("PRAGMA table_info(frames)")}
+        for col, col_type in ADDED_COLS.items():
+            if col not in cols:
+                self.conn.execute(f"ALTER TABLE frames ADD COLUMN {col} {col_type}")
         self.conn.execute(
             "CREATE UNIQUE INDEX IF NOT EXISTS idx_frames_cam_ts ON frames(cam_id, ts_vn_ms);"
         )
@@ -211,145 +701,327 @@ class DayDb:
             "CREATE INDEX IF NOT EXISTS idx_frames_ts ON frames(ts_vn_ms);"
         )
         self.conn.commit()
+        (self.db_root / self.cam_id / date_str).mkdir(exist_ok=True)
         self.current_date_str = date_str
+        self.last_sha = None  # mỗi file ngày tự chứa ảnh gốc của nó
 
-    def _ensure_open_for_today(self, ts_vn: datetime):
-        date_str = ts_vn.strftime("%Y-%m-%d")
-        if self.conn and self.current_date_str == date_str:
-            return
-        self._open_conn_for_date(date_str)
+    def _params(
+        self, row: Dict[str, Any], last_sha: Optional[str]
+    ) -> Tuple[Tuple[Any, ...], Optional[str]]:
+        """
+        (tuple tham số theo thứ tự UPSERT_COLS + cột ảnh, sha ảnh gốc mới nhất).
+        Frame trùng sha256 với ảnh gốc last_sha: bỏ bytes, ghi dup_of_sha.
+        """
+        ts_ms = row["ts_vn_ms"]
+        sha = row.get("sha256", "")
+        img_bytes = row.get("img_bytes") or b""
+        dup_of_sha = ""
+        if img_bytes and sha:
+            if sha == last_sha:
+                img_bytes = b""
+                dup_of_sha = sha
+            else:
+                last_sha = sha
+        if img_bytes:
+            # ảnh ra file riêng, DB chỉ giữ dòng nhỏ → WAL/checkpoint nhẹ
+            img = f"{self.current_date_str}/{ts_ms}{row.get('ext') or '.jpg'}"
+            write_file_atomic(self.db_root / self.cam_id / img, img_bytes)
+        else:
+            img = ""
+        return (
+            row["cam_id"],
+            ts_ms,
+            row["ts_vn_iso"],
+            row.get("chunk_file", ""),
+            row.get("code_slug", ""),
+            row.get("expand_url", ""),
+            row.get("img_url", ""),
+            row.get("content_type", ""),
+            row.get("ext", ""),
+            row.get("w"),
+            row.get("h"),
+            sha,
+            1 if row.get("was_gif") else 0,
+            1 if row.get("ok") else 0,
+            row.get("err", ""),
+            dup_of_sha,
+            img,
+        ), last_sha
+
+    def upsert_many(self, rows: List[Dict[str, Any]]):
+        """Ghi nhiều dòng trong transaction đang mở, commit khi đủ commit_every."""
+        by_date: Dict[str, List[Dict[str, Any]]] = {}
+        for row in rows:
+            by_date.setdefault(row["ts_vn_iso"][:10], []).append(row)
+        for date_str, day_rows in by_date.items():
+            if not (self.conn and self.current_date_str == date_str):
+                self._open_conn_for_date(date_str)
+            if not self.conn.in_transaction:
+                self.conn.execute("BEGIN IMMEDIATE")
+            # lỗi giữa chừng chỉ huỷ lô này, các dòng chờ commit trước đó giữ nguyên
+            self.conn.execute("SAVEPOINT batch")
+            last_sha = self.last_sha
+            params = []
+            try:
+                for r in day_rows:
+                    p, last_sha = self._params(r, last_sha)
+                    params.append(p)
+                self.conn.executemany(UPSERT_SQL, params)
+            except BaseException:
+                self.conn.execute("ROLLBACK TO batch")
+                self.conn.execute("RELEASE batch")
+                if not self._dirty:
+                    self.conn.rollback()  # không còn gì chờ → nhả write lock
+                # file ảnh đã ghi cho lô này không còn dòng nào trỏ tới → xoá
+                cam_dir = self.db_root / self.cam_id
+                for p in params:
+                    if p[-1]:
+                        try:
+                            os.unlink(cam_dir / p[-1])
+                        except OSError:
+                            pass
+                raise
+            self.conn.execute("RELEASE batch")
+            # chỉ nhận sha làm ảnh gốc khi file ảnh và dòng DB đều đã ghi xong,
+            # nếu không frame trùng sau đó sẽ trỏ tới ảnh không tồn tại
+            self.last_sha = last_sha
+            self._dirty += len(day_rows)
+        if self._dirty >= self.commit_every:
+            self.flush()
 
     def upsert_one(self, row: Dict[str, Any]):
-        ts: datetime = row["ts_vn"]
-        self._ensure_open_for_today(ts)
-        ts_ms = int(ts.timestamp() * 1000)
-        payload = {
-            "cam_id": row["cam_id"],
-            "ts_vn_ms": ts_ms,
-            "ts_vn_iso": ts.isoformat(),
-            "chunk_file": row.get("chunk_file", ""),
-            "code_slug": row.get("code_slug", ""),
-            "expand_url": row.get("expand_url", ""),
-            "img_url": row.get("img_url", ""),
-            "content_type": row.get("content_type", ""),
-            "ext": row.get("ext", ""),
-            "w": row.get("w"),
-            "h": row.get("h"),
-            "sha256": row.get("sha256", ""),
-            "was_gif": 1 if row.get("was_gif") else 0,
-            "ok": 1 if row.get("ok") else 0,
-            "err": row.get("err", ""),
-        }
-        if STORE_BASE64:
-            payload["img_b64"] = row.get("img_b64", "")
-            self.conn.execute(
-                """
-                INSERT INTO frames (
-                    cam_id, ts_vn_ms, ts_vn_iso, chunk_file, code_slug, expand_url,
-                    img_url, content_type, ext, w, h, sha256, was_gif, ok, err, img_b64
-                ) VALUES (
-                    :cam_id, :ts_vn_ms, :ts_vn_iso, :chunk_file, :code_slug, :expand_url,
-                    :img_url, :content_type, :ext, :w, :h, :sha256, :was_gif, :ok, :err, :img_b64
-                )
-                ON CONFLICT(cam_id, ts_vn_ms) DO UPDATE SET
-                    ts_vn_iso=excluded.ts_vn_iso,
-                    chunk_file=excluded.chunk_file,
-                    code_slug=excluded.code_slug,
-                    expand_url=excluded.expand_url,
-                    img_url=excluded.img_url,
-                    content_type=excluded.content_type,
-                    ext=excluded.ext,
-                    w=excluded.w,
-                    h=excluded.h,
-                    sha256=excluded.sha256,
-                    was_gif=excluded.was_gif,
-                    ok=excluded.ok,
-                    err=excluded.err,
-                    img_b64=excluded.img_b64
-                """,
-                payload,
-            )
-        else:
-            img_bytes = row.get("img_bytes", b"")
-            self.conn.execute(
-                """
-                INSERT INTO frames (
-                    cam_id, ts_vn_ms, ts_vn_iso, chunk_file, code_slug, expand_url,
-                    img_url, content_type, ext, w, h, sha256, was_gif, ok, err, img_bytes
-                ) VALUES (
-                    :cam_id, :ts_vn_ms, :ts_vn_iso, :chunk_file, :code_slug, :expand_url,
-                    :img_url, :content_type, :ext, :w, :h, :sha256, :was_gif, :ok, :err, :img_bytes
-                )
-                ON CONFLICT(cam_id, ts_vn_ms) DO UPDATE SET
-                    ts_vn_iso=excluded.ts_vn_iso,
-                    chunk_file=excluded.chunk_file,
-                    code_slug=excluded.code_slug,
-                    expand_url=excluded.expand_url,
-                    img_url=excluded.img_url,
-                    content_type=excluded.content_type,
-                    ext=excluded.ext,
-                    w=excluded.w,
-                    h=excluded.h,
-                    sha256=excluded.sha256,
-                    was_gif=excluded.was_gif,
-                    ok=excluded.ok,
-                    err=excluded.err,
-                    img_bytes=excluded.img_bytes
-                """,
-                {**payload, "img_bytes": sqlite3.Binary(img_bytes)},
-            )
-        self.conn.commit()
+        self.upsert_many([row])
+
+    def get_reader(self, date_str: Optional[str] = None) -> sqlite3.Connection:
+        """
+        Connection read-only (mode=ro) tới file của ngày date_str (mặc định:
+        ngày đang ghi). Nhờ WAL, truy vấn qua connection này không giữ write
+        lock nên không chặn writer thread. Dùng được từ thread khác.
+        """
+        date_str = date_str or self.current_date_str or now_vn().strftime("%Y-%m-%d")
+        with self._rlock:
+            if self.rconn is None or self._rconn_date != date_str:
+                if self.rconn is not None:
+                    self.rconn.close()
+                uri = f"{self._db_path_for_date(date_str).resolve().as_uri()}?mode=ro"
+                self.rconn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+                self.rconn.execute("PRAGMA query_only=ON;")
+                self._rconn_date = date_str
+            return self.rconn
+
+    def flush(self):
+        if self.conn and self._dirty:
+            self.conn.commit()
+        self._dirty = 0
 
     def close(self):
+        with self._rlock:
+            if self.rconn is not None:
+                self.rconn.close()
+            self.rconn = self._rconn_date = None
         if self.conn:
             try:
-                self.conn.commit()
+                self.flush()
+                # gộp WAL vào file DB và cắt WAL về 0 byte khi đóng
+                self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
             finally:
                 self.conn.close()
         self.conn = None
         self.current_date_str = None
 
 
+class SqliteWriter:
+    """
+    Thread riêng ghi frame vào các DayDb: event loop chỉ put() các dòng vào
+    queue, còn INSERT/commit (fsync)/close đều chạy trên thread này nên không
+    chặn việc tải ảnh. Mỗi DayDb chỉ được dùng từ thread này.
+    """
+
+    _STOP = object()
+
+    def __init__(
+        self,
+        sinks: Dict[str, DayDb],
+        batch: int = WRITER_BATCH,
+        flush_every: float = FLUSH_SEC,
+    ):
+        self.sinks = sinks
+        self.batch = batch
+        self.flush_every = flush_every
+        self.q: queue.Queue = queue.Queue()
+        self.thread = threading.Thread(
+            target=self._writer_loop, name="sqlite-writer", daemon=True
+        )
+
+    def start(self):
+        self.thread.start()
+
+    def put(self, rows: List[Dict[str, Any]]):
+        if rows:
+            self.q.put(rows)
+
+    def close(self):
+        self.q.put(self._STOP)
+        self.thread.join()
+
+    def _write(self, rows: List[Dict[str, Any]]):
+        by_cam: Dict[str, List[Dict[str, Any]]] = {}
+        for row in rows:
+            by_cam.setdefault(row["cam_id"], []).append(row)
+        for cam_id, cam_rows in by_cam.items():
+            try:
+                self.sinks[cam_id].upsert_many(cam_rows)
+            except Exception as e:
+                print(f"[DB] lỗi ghi {cam_id}: {e}", file=sys.stderr)
+
+    def _flush_all(self):
+        for s in self.sinks.values():
+            try:
+                s.flush()
+            except Exception as e:
+                print(f"[DB] lỗi commit {s.cam_id}: {e}", file=sys.stderr)
+
+    def _writer_loop(self):
+        next_flush = time.monotonic() + self.flush_every
+        stop = False
+        while not stop:
+            rows: List[Dict[str, Any]] = []
+            try:
+                item = self.q.get(timeout=max(0.0, next_flush - time.monotonic()))
+                # gom thêm các tick đang chờ trong queue vào cùng 1 lần ghi
+                while True:
+                    if item is self._STOP:
+                        stop = True
+                        break
+                    rows.extend(item)
+                    if len(rows) >= self.batch:
+                        break
+                    item = self.q.get_nowait()
+            except queue.Empty:
+                pass
+            if rows:
+                self._write(rows)
+            if time.monotonic() >= next_flush:
+                self._flush_all()
+                next_flush = time.monotonic() + self.flush_every
+        for s in self.sinks.values():
+            try:
+                s.close()
+            except Exception:
+                pass
+
+
+# URL ảnh + digest bytes lấy được ở tick trước, theo cam_id
+_LAST_IMG: Dict[str, Tuple[str, str]] = {}
+
+
+def frame_digest(b: bytes) -> str:
+    """Hash toàn bộ nội dung frame, dùng để so frame trùng giữa các tick."""
+    if xxhash is not None:
+        return xxhash.xxh3_128_hexdigest(b)
+    return sha256_bytes(b)
+
+
+async def fetch_via_page(
+    pool: PagePool, http: httpx.AsyncClient, cam_id: str, expand: str
+) -> Tuple[Optional[str], Optional[bytes], Optional[str], Optional[str]]:
+    """Đọc URL ảnh đang hiển thị trên page rồi lấy bytes: (img_url, b, ct, err)."""
+    async with pool.acquire(cam_id) as page:
+        img_url = await get_displayed_img_url(page)
+        if not img_url:
+            await pool.wait_for_img(page, IMG_READY_RETRY_MS)
+            img_url = await get_displayed_img_url(page)
+        # mọi lỗi của page (kể cả renderer crash) đều bị nuốt thành
+        # "không có ảnh" → đếm để acquire mở lại page khi lỗi lặp lại
+        pool.report(cam_id, bool(img_url))
+        if not img_url:
+            return None, None, None, "no_img_found"
+
+        # ưu tiên bytes browser đã tải sẵn, chỉ GET lại khi không có
+        b, ct = await pool.take_image(cam_id, img_url)
+        if not b:
+            b, ct = await fetch_img_bytes(http, img_url, expand)
+        if not b:
+            await asyncio.sleep(1.0)
+            await sync_cookies(http, pool.context)
+            b, ct = await fetch_img_bytes(http, img_url, expand)
+        return img_url, b, ct, (None if b else "fetch_failed")
+
+
+def failed_row(
+    cam: Dict[str, Any], sink: DayDb, ts_ms: int, ts_iso: str, err: str
+) -> Dict[str, Any]:
+    """Dòng ok=0 cho camera mà capture_and_record không trả được kết quả."""
+    return {
+        "ts_vn_ms": ts_ms,
+        "ts_vn_iso": ts_iso,
+        "chunk_file": sink.chunk_file,
+        "cam_id": cam.get("cam_id") or "unknown",
+        "code_slug": cam["_slug"],
+        "expand_url": cam.get("expand_url") or "",
+        "ok": False,
+        "err": err,
+    }
+
+
 async def capture_and_record(
-    pair: Tuple[Dict[str, Any], Page], sink: DayDb
-) -> Tuple[bool, str]:
-    cam, page = pair
+    cam: Dict[str, Any],
+    pool: PagePool,
+    http: httpx.AsyncClient,
+    sink: DayDb,
+    ts_ms: int,
+    ts_iso: str,
+) -> Tuple[bool, Dict[str, Any]]:
+    """
+    Chụp 1 camera, trả về (ok, row); ghi DB do run_loop gom theo tick.
+    ts_ms/ts_iso tính sẵn 1 lần mỗi tick, writer thread không phải tính lại.
+    """
     cam_id = cam.get("cam_id") or "unknown"
-    code_slug = slugify(cam.get("code") or cam.get("title") or "nocode")
+    code_slug = cam["_slug"]
     expand = cam.get("expand_url") or ""
-    ts = now_vn()
 
     ok = False
     err = None
-    img_url = await get_displayed_img_url(page)
+    img_url = None
     out_bytes = None
     content_type = None
     ext = None
     w = h = None
     was_gif = False
 
-    if not img_url:
-        await asyncio.sleep(1.0)
-        img_url = await get_displayed_img_url(page)
-
-    if img_url:
-        b, ct = await fetch_img_bytes(page, img_url, expand)
-        if not b:
-            await asyncio.sleep(1.0)
-            b, ct = await fetch_img_bytes(page, img_url, expand)
-        if b:
-            b2, ext, was_gif, w, h = force_jpeg_if_gif(b, ct, img_url)
-            out_bytes = b2
-            ok = True
-            content_type = "image/jpeg" if was_gif else (ct or "image/jpeg")
+    b = ct = digest = None
+    last = _LAST_IMG.get(cam_id)
+    if last is not None:
+        # GET thẳng URL ảnh của tick trước, không cần hỏi page; lỗi hoặc bytes
+        # y hệt lần trước (URL cũ/ảnh giữ chỗ) thì mới đọc lại URL trên page
+        b, ct = await fetch_img_bytes(http, last[0], expand)
+        digest = frame_digest(b) if b else None
+        if b and digest != last[1]:
+            img_url = last[0]
         else:
-            err = "fetch_failed"
-    else:
-        err = "no_img_found"
+            if not b:
+                # có thể cookie session đã đổi → lấy lại từ browser
+                await sync_cookies(http, pool.context)
+            b = ct = digest = None
+    if b is None:
+        img_url, b, ct, err = await fetch_via_page(pool, http, cam_id, expand)
+
+    if b:
+        # frame lấy thẳng đã hash khi so với tick trước → dùng lại digest đó
+        _LAST_IMG[cam_id] = (img_url, digest or frame_digest(b))
+        # PIL decode/encode chặn event loop → chạy trong thread để
+        # các cam khác vẫn tiếp tục I/O
+        b2, ext, was_gif, w, h = await asyncio.to_thread(
+            force_jpeg_if_gif, b, ct, img_url
+        )
+        out_bytes = b2
+        ok = True
+        content_type = "image/jpeg" if was_gif else (ct or "image/jpeg")
 
     sha_hex = sha256_bytes(out_bytes) if (ok and out_bytes) else ""
     row: Dict[str, Any] = {
-        "ts_vn": ts,
+        "ts_vn_ms": ts_ms,
+        "ts_vn_iso": ts_iso,
         "chunk_file": sink.chunk_file,
         "cam_id": cam_id,
         "code_slug": code_slug,
@@ -363,23 +1035,20 @@ async def capture_and_record(
         "was_gif": was_gif,
         "ok": ok,
         "err": err or "",
+        "img_bytes": out_bytes if (ok and out_bytes) else b"",
     }
-    if STORE_BASE64:
-        row["img_b64"] = (
-            base64.b64encode(out_bytes).decode("ascii") if (ok and out_bytes) else ""
-        )
-    else:
-        row["img_bytes"] = out_bytes if (ok and out_bytes) else b""
-
-    try:
-        sink.upsert_one(row)
-    except Exception:
-        return False, code_slug
-    return ok, code_slug
+    return ok, row
 
 
 # ----------- ESC listener (Windows & Unix) -----------
-def start_esc_listener(stop_event: threading.Event):
+def start_esc_listener(
+    stop_event: threading.Event, loop: asyncio.AbstractEventLoop
+) -> Callable[[], None]:
+    """
+    Bấm ESC → stop_event.set(). Trả về hàm dọn dẹp, gọi khi dừng runner.
+    Windows: thread đọc msvcrt. POSIX: event loop tự theo dõi stdin
+    (add_reader), chỉ thức dậy khi có phím bấm, không cần thread polling.
+    """
     if os.name == "nt":
         import msvcrt
 
@@ -392,92 +1061,143 @@ def start_esc_listener(stop_event: threading.Event):
                         break
 
         threading.Thread(target=worker, daemon=True).start()
-    else:
-        import termios, tty, select
+        return lambda: None
 
-        def worker():
-            fd = sys.stdin.fileno()
-            old = termios.tcgetattr(fd)
-            try:
-                tty.setcbreak(fd)
-                while not stop_event.is_set():
-                    r, _, _ = select.select([sys.stdin], [], [], 0.2)
-                    if r:
-                        ch = sys.stdin.read(1)
-                        if ch == "\x1b":  # ESC
-                            stop_event.set()
-                            break
-            finally:
-                termios.tcsetattr(fd, termios.TCSADRAIN, old)
+    if not sys.stdin.isatty():
+        return lambda: None  # stdin không phải terminal (chạy nền / pipe)
 
-        threading.Thread(target=worker, daemon=True).start()
+    import termios, tty
+
+    fd = sys.stdin.fileno()
+    old = termios.tcgetattr(fd)
+    tty.setcbreak(fd)
+
+    def on_key():
+        if b"\x1b" in os.read(fd, 32):  # ESC
+            stop_event.set()
+
+    loop.add_reader(fd, on_key)
+
+    def cleanup():
+        loop.remove_reader(fd)
+        termios.tcsetattr(fd, termios.TCSADRAIN, old)
+
+    return cleanup
 
 
 # ------------------------------ RUN LOOP ------------------------------
-async def run_loop(cams: List[Dict[str, Any]], chunk_file_name: str):
+async def run_loop(
+    cams: List[Dict[str, Any]], chunk_file_name: str, cfg: CaptureConfig
+):
     cams = cams[:6]
-    DB_ROOT.mkdir(parents=True, exist_ok=True)
+    cfg.db_root.mkdir(parents=True, exist_ok=True)
     sinks: Dict[str, DayDb] = {
         (c.get("cam_id") or "unknown"): DayDb(
-            DB_ROOT, c.get("cam_id") or "unknown", chunk_file_name
+            cfg.db_root, c.get("cam_id") or "unknown", chunk_file_name
         )
         for c in cams
     }
+    writer = SqliteWriter(sinks)
+    writer.start()
+
+    # slug và nhãn debug của từng cam không đổi giữa các tick → tính 1 lần
+    for c in cams:
+        c["_slug"] = slugify(c.get("code") or c.get("title") or "nocode")
+    labels = [short_lab(c["_slug"]) for c in cams]
 
     stop_event = threading.Event()
-    start_esc_listener(stop_event)
+    stop_esc_listener = start_esc_listener(stop_event, asyncio.get_running_loop())
 
     browser = None
     context = None
+    http = None
     try:
         async with async_playwright() as pw:
-            browser = await pw.chromium.launch(headless=not HEADFUL)
+            browser = await pw.chromium.launch(
+                headless=not cfg.headful, args=CHROMIUM_ARGS
+            )
             context = await browser.new_context()
-            cam_pages = await init_six_pages(context, cams)
+            # cam chậm/treo không được kéo cả tick quá chu kỳ chụp
+            capture_timeout = max(1.0, cfg.interval - 2.0)
+            # GET ảnh / chờ ảnh phải hết hạn trước capture_timeout để còn đi
+            # nhánh fetch_failed/thử lại thay vì bị huỷ thành "timeout"
+            net_timeout = max(0.5, min(cfg.page_timeout, capture_timeout - 1.0))
+            pool = PagePool(context, cams, cfg.max_pages, net_timeout)
+            await pool.open_all()
+            http = await new_http_client(context, net_timeout)
+            if cfg.offset > 0:
+                await asyncio.sleep(cfg.offset)
 
+            loop = asyncio.get_running_loop()
+            next_cookie_sync = loop.time() + COOKIE_SYNC_SEC
             while not stop_event.is_set():
-                start = asyncio.get_event_loop().time()
-                ts_label = now_vn().strftime("%H:%M:%S")
+                start = loop.time()
+                if start >= next_cookie_sync:
+                    await sync_cookies(http, context)
+                    next_cookie_sync = start + COOKIE_SYNC_SEC
+                # lấy giờ 1 lần mỗi tick, dùng chung cho cả 6 cam và nhãn log
+                ts = now_vn()
+                ts_ms = int(ts.timestamp() * 1000)
+                ts_iso = ts.isoformat()
+                ts_label = ts_iso[11:19]
 
                 results = await asyncio.gather(
                     *[
                         asyncio.create_task(
-                            capture_and_record(
-                                (cam, page), sinks[cam.get("cam_id") or "unknown"]
+                            asyncio.wait_for(
+                                capture_and_record(
+                                    cam,
+                                    pool,
+                                    http,
+                                    sinks[cam.get("cam_id") or "unknown"],
+                                    ts_ms,
+                                    ts_iso,
+                                ),
+                                timeout=capture_timeout,
                             )
                         )
-                        for cam, page in cam_pages
+                        for cam in cams
                     ],
                     return_exceptions=True,
                 )
 
-                # tổng hợp & in debug
-                oks: List[bool] = []
-                labs: List[str] = []
-                for r, (cam, _p) in zip(results, cam_pages):
-                    lab = slugify(cam.get("code") or cam.get("title") or "nocode")
-                    if isinstance(r, Exception):
-                        oks.append(False)
-                        labs.append(lab)
+                rows = []
+                for cam, r in zip(cams, results):
+                    if not isinstance(r, BaseException):
+                        rows.append(r[1])
+                        continue
+                    cam_id = cam.get("cam_id") or "unknown"
+                    if isinstance(r, asyncio.TimeoutError):
+                        # page treo đã được acquire đánh dấu mở lại (nếu hết
+                        # giờ khi đang dùng page); GET thẳng chậm thì không
+                        err = "timeout"
                     else:
-                        ok, lab2 = r
-                        oks.append(bool(ok))
-                        labs.append(lab2 or lab)
+                        err = f"{type(r).__name__}: {r}"
+                    rows.append(failed_row(cam, sinks[cam_id], ts_ms, ts_iso, err))
+                # giao các dòng của tick cho writer thread, không chờ ghi xong
+                writer.put(rows)
 
-                ok_total = sum(1 for x in oks if x)
+                # tổng hợp & in debug
+                oks = [not isinstance(r, BaseException) and bool(r[0]) for r in results]
+                ok_total = sum(oks)
                 den = len(oks)
-                if DEBUG:
-                    parts = [
-                        f"[{'✓' if o else '×'} {short_lab(l)}]"
-                        for o, l in zip(oks, labs)
-                    ]
-                    print(f"{ts_label} {ok_total}/{den}", *parts)
+                if cfg.debug:
+                    parts = " ".join(
+                        f"[{'✓' if o else '×'} {lab}]" for o, lab in zip(oks, labels)
+                    )
+                    print(f"{ts_label} {ok_total}/{den} {parts}")
                 else:
                     print(f"{ts_label} {ok_total}/{den}")
 
-                elapsed = asyncio.get_event_loop().time() - start
-                await asyncio.sleep(max(0.0, INTERVAL_SEC - elapsed))
+                elapsed = loop.time() - start
+                await asyncio.sleep(max(0.0, cfg.interval - elapsed))
     finally:
+        stop_esc_listener()
+        try:
+            if http:
+                await http.aclose()
+        except Exception:
+            pass
         try:
             if context:
                 await context.close()
@@ -488,21 +1208,74 @@ async def run_loop(cams: List[Dict[str, Any]], chunk_file_name: str):
                 await browser.close()
         except Exception:
             pass
-        for s in sinks.values():
-            try:
-                s.close()
-            except Exception:
-                pass
+        # writer ghi nốt các dòng còn trong queue, commit rồi đóng các DayDb;
+        # join() chặn tới khi xong nên chờ trong thread, không chặn event loop
+        await asyncio.to_thread(writer.close)
 
 
 # --------------------------------- CLI ---------------------------------
+def load_cams(path: Path) -> List[Dict[str, Any]]:
+    if orjson is not None:
+        return orjson.loads(path.read_bytes())
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
 def main():
+    d = CaptureConfig()
     ap = argparse.ArgumentParser()
     ap.add_argument("--chunk-file", required=True)
+    ap.add_argument(
+        "--interval",
+        type=float,
+        default=d.interval,
+        help="Khoảng cách giữa các lần chụp (giây)",
+    )
+    ap.add_argument(
+        "--offset", type=float, default=d.offset, help="Delay ban đầu (giây)"
+    )
+    ap.add_argument(
+        "--page-timeout",
+        type=float,
+        default=d.page_timeout,
+        help="Timeout tải ảnh (giây)",
+    )
+    ap.add_argument(
+        "--headful",
+        action=argparse.BooleanOptionalAction,
+        default=d.headful,
+        help="Hiển thị browser GUI",
+    )
+    ap.add_argument(
+        "--debug",
+        action=argparse.BooleanOptionalAction,
+        default=d.debug,
+        help="In trạng thái từng camera mỗi lần chụp",
+    )
+    ap.add_argument(
+        "--db-root",
+        type=Path,
+        default=d.db_root,
+        help="Thư mục chứa các file SQLite theo camera/ngày",
+    )
+    ap.add_argument(
+        "--max-pages",
+        type=int,
+        default=d.max_pages,
+        help="Số page Chromium dùng chung cho các camera (0 = mỗi camera 1 page)",
+    )
     args = ap.parse_args()
+    cfg = CaptureConfig(
+        interval=args.interval,
+        offset=args.offset,
+        page_timeout=args.page_timeout,
+        headful=args.headful,
+        debug=args.debug,
+        db_root=args.db_root,
+        max_pages=args.max_pages,
+    )
     p = Path(args.chunk_file)
-    cams = json.loads(p.read_text(encoding="utf-8"))
-    asyncio.run(run_loop(cams, chunk_file_name=p.name))
+    cams = load_cams(p)
+    asyncio.run(run_loop(cams, chunk_file_name=p.name, cfg=cfg))
 
 
 if __name__ == "__main__":
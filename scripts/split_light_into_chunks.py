@@ -2,6 +2,12 @@ import json
 from pathlib import Path
 from datetime import datetime
 
+try:
+    # orjson đọc/ghi thẳng bytes, nhanh hơn json của stdlib
+    import orjson
+except ImportError:
+    orjson = None
+
 INPUT_PATH = "../camera_catalog/camera_catalog_light.json"
 OUTPUT_DIR = Path("../camera_catalog_chunks")
 CHUNK_SIZE = 6  # mỗi file 6 camera
@@ -13,9 +19,23 @@ def chunks(seq, size):
         yield seq[i : i + size]
 
 
+def load_json(path: Path):
+    if orjson is not None:
+        return orjson.loads(path.read_bytes())
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def write_json(path: Path, obj) -> None:
+    if orjson is not None:
+        # orjson giữ nguyên ký tự UTF-8 như ensure_ascii=False
+        path.write_bytes(orjson.dumps(obj, option=orjson.OPT_INDENT_2))
+    else:
+        path.write_text(json.dumps(obj, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
 def main():
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-    data = json.loads(Path(INPUT_PATH).read_text(encoding="utf-8"))
+    data = load_json(Path(INPUT_PATH))
     cams = [c for c in data if c.get("expand_url")]
 
     if not PRESERVE_ORDER:
@@ -30,9 +50,7 @@ def main():
     count = 0
     for idx, block in enumerate(chunks(cams, CHUNK_SIZE)):
         out_path = OUTPUT_DIR / f"cams_chunk_{idx:03d}.json"
-        out_path.write_text(
-            json.dumps(block, ensure_ascii=False, indent=2), encoding="utf-8"
-        )
+        write_json(out_path, block)
         print(f"[OK] {out_path}  ({len(block)} cams)")
         count += 1
 
@@ -43,9 +61,7 @@ def main():
         "total_cameras": total,
         "total_files": count,
     }
-    (OUTPUT_DIR / "index.json").write_text(
-        json.dumps(index, ensure_ascii=False, indent=2), encoding="utf-8"
-    )
+    write_json(OUTPUT_DIR / "index.json", index)
     print(f"\n[OK] Đã tạo {count} file trong thư mục {OUTPUT_DIR}/")
     print(f"[OK] Ghi chỉ mục: {OUTPUT_DIR/'index.json'}")
 